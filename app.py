@@ -1,8 +1,8 @@
 import streamlit as st
 from dotenv import load_dotenv
 
-from firebase_operations import initialize_firebase, load_styles
-from ui_components import render_style_editor, render_text_converter
+from firebase_operations import get_style_writer, initialize_firebase, load_styles
+from ui_components import render_style_editor, render_sync_status, render_text_converter
 
 
 def main():
@@ -25,7 +25,9 @@ def main():
 
     # セッション状態の初期化
     if 'styles' not in st.session_state:
-        st.session_state.styles = load_styles()
+        # 保存待ちの変更があればFirebaseより優先する
+        pending_styles = get_style_writer().pending_styles()
+        st.session_state.styles = pending_styles if pending_styles is not None else load_styles()
     if 'editing_style' not in st.session_state:
         st.session_state.editing_style = None
     if 'on_example_modified' not in st.session_state:
@@ -50,6 +52,8 @@ def main():
     if st.session_state.get("success_message", False):
         st.success(st.session_state.success_message)
 
+    render_sync_status()
+
     render_text_converter()
 
 if __name__ == "__main__":
@@ -1,12 +1,18 @@
+import json
+import logging
 import os
+import threading
+import time
 from dataclasses import asdict
-from typing import List
+from typing import List, Optional
 
 import firebase_admin
 import streamlit as st
 from firebase_admin import credentials, db
 
-from models import Example, Style
+from models import Example, Style, SyncStatus
+
+logger = logging.getLogger(__name__)
 
 
 def initialize_firebase():
@@ -27,6 +33,17 @@ def initialize_firebase():
         'databaseURL': os.getenv('FIREBASE_DATABASE_URL')
     })
 
+def _parse_styles(raw_styles_data) -> List[Style]:
+    """保存形式の文体データをStyleのリストに変換"""
+    styles = []
+    for style in raw_styles_data:
+        examples = [Example(**example) for example in style.get('examples', [])]
+        styles.append(Style(
+            name=style.get('name', ''),
+            examples=examples
+        ))
+    return styles
+
 def load_styles() -> List[Style]:
     """文体データをFirebaseから読み込む"""
     try:
@@ -34,33 +51,174 @@ def load_styles() -> List[Style]:
         raw_styles_data = ref.get()
         if not raw_styles_data:
             return []
-
-        styles = []
-        for style in raw_styles_data:
-            examples = [Example(**example) for example in style.get('examples', [])]
-            styles.append(Style(
-                name=style.get('name', ''),
-                examples=examples
-            ))
-        return styles
+        return _parse_styles(raw_styles_data)
     except Exception as e:
         st.error(f"データの読み込みに失敗しました: {str(e)}")
         return []
 
-def save_styles(styles: List[Style]):
-    """文体データをFirebaseに保存"""
-    try:
-        ref = db.reference('/styles')
-        # 既存のデータを削除
-        ref.delete()
-        # 新しいデータを保存
-        for i, style in enumerate(styles):
-            style_ref = ref.child(str(i))
-            style_ref.set({
-                'name': style.name,
-                'examples': {
-                    str(j): asdict(example) for j, example in enumerate(style.examples)
-                }
-            })
-    except Exception as e:
-        st.error(f"データの保存に失敗しました: {str(e)}")
+def write_styles(styles: List[Style]):
+    """文体データをFirebaseに1回の書き込みで保存（失敗時は例外を送出）"""
+    db.reference('/styles').set({
+        str(i): {
+            'name': style.name,
+            'examples': {
+                str(j): asdict(example) for j, example in enumerate(style.examples)
+            }
+        }
+        for i, style in enumerate(styles)
+    })
+
+class StyleWriter:
+    """文体データの保存をバックグラウンドで行うライトビハインドキュー
+
+    保存依頼はローカルのジャーナルに記録してすぐに戻り、短時間に続いた依頼は最新の内容だけをまとめて書き込む。
+    書き込みに失敗した場合はジャーナルを残したまま間隔を空けて再試行する。
+    """
+
+    def __init__(self, journal_path: str, debounce: float = 0.5, retry_interval: float = 1.0,
+                 max_retry_interval: float = 30.0):
+        self._journal_path = journal_path
+        self._debounce = debounce
+        self._retry_interval = retry_interval
+        self._max_retry_interval = max_retry_interval
+        self._condition = threading.Condition()
+        self._pending: Optional[List[Style]] = None
+        self._version = 0
+        self._synced_version = 0
+        self._closed = False
+        self._failures = 0
+        self._last_synced_at: Optional[float] = None
+        self._last_error: Optional[str] = None
+        self._journal_error: Optional[str] = None
+
+        # 前回のプロセスで書き込めなかった変更があれば再送する
+        if os.path.exists(journal_path):
+            self._pending = self._read_journal()
+            if self._pending is not None:
+                self._version += 1
+
+        self._thread = threading.Thread(target=self._run, name="StyleWriter", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, styles: List[Style]) -> int:
+        """保存を依頼する（ジャーナルへの記録後すぐに戻る）
+
+        戻り値の版数をstatus()に渡すと、その依頼の保存状況を確認できる。
+        """
+        with self._condition:
+            self._pending = [Style(name=style.name, examples=list(style.examples)) for style in styles]
+            self._version += 1
+            self._condition.notify_all()
+            try:
+                self._write_journal(self._pending)
+                self._journal_error = None
+            except OSError as e:
+                # ジャーナルに記録できなくても、メモリ上の変更は保存を続ける
+                logger.exception("保存待ちデータをジャーナルに記録できませんでした")
+                self._journal_error = str(e)
+            return self._version
+
+    def close(self, timeout: float = 5.0):
+        """バックグラウンドの書き込みを停止する（保存待ちの変更はジャーナルに残る）"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+
+    def pending_styles(self) -> Optional[List[Style]]:
+        """まだFirebaseに書き込まれていない文体データ（なければNone）"""
+        with self._condition:
+            return None if self._pending is None else list(self._pending)
+
+    def status(self, version: Optional[int] = None) -> SyncStatus:
+        """保存状況（versionを指定した場合は、enqueueが返したその版数までの依頼についての状況）"""
+        with self._condition:
+            if version is None:
+                pending = self._pending is not None
+            else:
+                pending = version > self._synced_version
+            return SyncStatus(
+                pending=pending,
+                last_synced_at=self._last_synced_at,
+                # 保存済みの依頼には、その後の失敗を表示しない
+                last_error=self._last_error if pending else None,
+                journal_error=self._journal_error if pending else None
+            )
+
+    def _read_journal(self) -> Optional[List[Style]]:
+        try:
+            with open(self._journal_path, encoding='utf-8') as f:
+                return _parse_styles(json.load(f))
+        except Exception:
+            # 読めないジャーナルは退避し、空のキューで始める
+            corrupt_path = f"{self._journal_path}.corrupt"
+            logger.exception("保存待ちデータのジャーナルを読み込めませんでした。%s に退避します", corrupt_path)
+            try:
+                os.replace(self._journal_path, corrupt_path)
+            except OSError:
+                logger.exception("ジャーナルを退避できませんでした")
+            return None
+
+    def _write_journal(self, styles: List[Style]):
+        tmp_path = f"{self._journal_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump([asdict(style) for style in styles], f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._journal_path)
+
+    def _remove_journal(self):
+        try:
+            if os.path.exists(self._journal_path):
+                os.remove(self._journal_path)
+        except OSError:
+            # 次回起動時に同じ内容を再送するだけなので、保存は完了として扱う
+            logger.exception("ジャーナルを削除できませんでした")
+
+    def _run(self):
+        while not self._closed:
+            try:
+                self._sync()
+            except Exception as e:
+                logger.exception("文体データの保存に失敗しました")
+                with self._condition:
+                    self._failures += 1
+                    self._last_error = str(e)
+                    self._wait_closed(min(self._retry_interval * 2 ** (self._failures - 1), self._max_retry_interval))
+
+    def _wait_closed(self, timeout: float):
+        """close()されるかtimeout秒経つまで待つ（ロックを取得した状態で呼ぶ）"""
+        deadline = time.monotonic() + timeout
+        while not self._closed and time.monotonic() < deadline:
+            self._condition.wait(deadline - time.monotonic())
+
+    def _sync(self):
+        """保存待ちの文体データを1回書き込む"""
+        with self._condition:
+            while self._pending is None and not self._closed:
+                self._condition.wait()
+
+            # 連続した編集を1回の書き込みにまとめる
+            self._wait_closed(self._debounce)
+            if self._closed:
+                return
+
+            styles = self._pending
+            version = self._version
+
+        write_styles(styles)
+
+        with self._condition:
+            self._failures = 0
+            self._last_error = None
+            self._last_synced_at = time.time()
+            self._synced_version = version
+            # 書き込み中に新しい依頼がなければ完了
+            if self._version == version:
+                self._pending = None
+                self._remove_journal()
+
+@st.cache_resource
+def get_style_writer() -> StyleWriter:
+    """プロセス内で共有するStyleWriterを取得"""
+    return StyleWriter(os.getenv('STYLES_JOURNAL_PATH', '.styles_journal.json'))
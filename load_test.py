@@ -0,0 +1,465 @@
+import argparse
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+from unittest import mock
+
+from langchain_core.runnables import RunnableGenerator
+from streamlit.testing.v1 import AppTest
+
+from firebase_operations import get_style_writer
+from routing_operations import get_route_stats
+
+try:
+    import resource
+except ImportError:  # Windowsにはresourceモジュールがない
+    resource = None
+
+APP_FILE = "app.py"
+SEED_STYLE_NAME = "負荷テスト用文体"
+SAMPLE_INPUT = "本日の会議は午後三時から始まります。資料は事前に共有しますので目を通しておいてください。"
+
+
+@dataclass
+class Latency:
+    """対数正規分布に従う遅延（秒）"""
+    median: float
+    sigma: float = 0.5
+
+    def sample(self, rng: random.Random) -> float:
+        if self.median <= 0:
+            return 0.0
+        return rng.lognormvariate(math.log(self.median), self.sigma)
+
+
+@dataclass
+class LoadTestConfig:
+    users: int = 20
+    concurrency: int = 10
+    iterations: int = 3
+    db_latency: Latency = field(default_factory=lambda: Latency(0.08))
+    llm_first_token_latency: Latency = field(default_factory=lambda: Latency(0.6))
+    llm_chunk_latency: Latency = field(default_factory=lambda: Latency(0.02))
+    llm_output_chunks: int = 40
+    seed_examples: int = 20
+    timeout: float = 120.0
+    seed: Optional[int] = None
+
+
+class FakeReference:
+    """firebase_admin.db.Referenceの代わりにメモリ上のデータを読み書きする"""
+
+    def __init__(self, database: "FakeDatabase", path: List[str]):
+        self._database = database
+        self._path = path
+
+    def child(self, path: str) -> "FakeReference":
+        return FakeReference(self._database, self._path + [p for p in path.split('/') if p])
+
+    def get(self):
+        self._database.wait()
+        with self._database.lock:
+            node = self._database.root
+            for key in self._path:
+                if not isinstance(node, dict) or key not in node:
+                    return None
+                node = node[key]
+            return _to_firebase_value(json.loads(json.dumps(node)))
+
+    def set(self, value):
+        self._database.wait()
+        with self._database.lock:
+            node = self._database.root
+            for key in self._path[:-1]:
+                node = node.setdefault(key, {})
+            node[self._path[-1]] = json.loads(json.dumps(value))
+
+    def delete(self):
+        self._database.wait()
+        with self._database.lock:
+            node = self._database.root
+            for key in self._path[:-1]:
+                node = node.get(key, {})
+            node.pop(self._path[-1], None)
+
+
+class FakeDatabase:
+    """Realtime Databaseの遅延を再現するフェイク（firebase_admin.dbと同じreference()を持つ）"""
+
+    def __init__(self, latency: Latency, rng: random.Random):
+        self.root: Dict = {}
+        self.lock = threading.Lock()
+        self._latency = latency
+        self._rng = rng
+        self._rng_lock = threading.Lock()
+
+    def wait(self):
+        with self._rng_lock:
+            delay = self._latency.sample(self._rng)
+        time.sleep(delay)
+
+    def reference(self, path: str = '/') -> FakeReference:
+        return FakeReference(self, [p for p in path.split('/') if p])
+
+
+def _to_firebase_value(value):
+    """連番のキーを持つ辞書をリストに変換する（Realtime Databaseの挙動に合わせる）"""
+    if isinstance(value, dict):
+        converted = {key: _to_firebase_value(child) for key, child in value.items()}
+        if converted and all(key.isdigit() for key in converted):
+            indexes = sorted(int(key) for key in converted)
+            if indexes == list(range(len(indexes))):
+                return [converted[str(i)] for i in indexes]
+        return converted
+    return value
+
+
+def create_fake_llm(config: LoadTestConfig, rng: random.Random):
+    """ChatOpenAIの代わりに、遅延付きで文字列をストリーミングするRunnableを返す"""
+    rng_lock = threading.Lock()
+
+    def sample(latency: Latency) -> float:
+        with rng_lock:
+            return latency.sample(rng)
+
+    def fake_chat_model(**_kwargs):
+        def stream(inputs):
+            for _ in inputs:
+                pass
+            time.sleep(sample(config.llm_first_token_latency))
+            for i in range(config.llm_output_chunks):
+                if i:
+                    time.sleep(sample(config.llm_chunk_latency))
+                yield "ございます。"
+
+        return RunnableGenerator(stream)
+
+    return fake_chat_model
+
+
+def seed_database(database: FakeDatabase, config: LoadTestConfig):
+    """変換用の文体をあらかじめ登録しておく"""
+    database.root['styles'] = {
+        '0': {
+            'name': SEED_STYLE_NAME,
+            'examples': {
+                str(i): {'input': f"例文{i}です。", 'output': f"例文{i}でございます。"}
+                for i in range(config.seed_examples)
+            },
+        }
+    }
+
+
+def _button(at: AppTest, label: str):
+    return next(button for button in at.button if button.label == label)
+
+
+class AppError(Exception):
+    """アプリ側で発生したエラー（負荷試験ツール自体の不具合と区別する）"""
+
+
+def _check(at: AppTest):
+    if at.exception:
+        raise AppError(at.exception[0].message)
+
+
+class SessionRecorder:
+    """1セッション分の操作ごとの所要時間を記録する"""
+
+    def __init__(self):
+        self.timings: Dict[str, List[float]] = {}
+
+    def measure(self, operation: str, action):
+        start = time.perf_counter()
+        result = action()
+        self.timings.setdefault(operation, []).append(time.perf_counter() - start)
+        return result
+
+
+def run_session(user_id: int, config: LoadTestConfig, recorder: SessionRecorder) -> AppTest:
+    """1ユーザー分の操作（初回表示→文体追加→変換）を繰り返す"""
+    at = AppTest.from_file(APP_FILE, default_timeout=config.timeout)
+    recorder.measure("initial_load", at.run)
+    _check(at)
+
+    for iteration in range(config.iterations):
+        _button(at, "✏️ 文体を編集する").click()
+        at.run()
+        at.text_input[0].input(f"負荷テスト{user_id}-{iteration}")
+        # AppTestはダイアログ内だけの再実行ができないため、編集ボタンも押した状態で再実行する
+        _button(at, "✏️ 文体を編集する").click()
+        _button(at, "追加").click()
+        recorder.measure("add_style", at.run)
+        _check(at)
+
+        at.selectbox(key="style_selector").select(SEED_STYLE_NAME)
+        at.text_area[0].input(SAMPLE_INPUT)
+        _button(at, "変換開始").click()
+        recorder.measure("convert", at.run)
+        _check(at)
+
+    # このセッションの変更がバックグラウンドで書き込まれるまでの時間
+    if "style_write_version" in at.session_state:
+        version = at.session_state["style_write_version"]
+        recorder.measure("write_drain", lambda: _wait_for_write(version, config.timeout))
+    return at
+
+
+def _wait_for_write(version: int, timeout: float):
+    deadline = time.perf_counter() + timeout
+    while get_style_writer().status(version).pending:
+        if time.perf_counter() > deadline:
+            raise AppError(f"書き込みが{timeout}秒以内に完了しませんでした: {get_style_writer().status(version)}")
+        time.sleep(0.05)
+
+
+def _max_rss_bytes() -> Optional[int]:
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOSはバイト、Linuxはキロバイト単位
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    ordered = sorted(values)
+    index = max(0, math.ceil(len(ordered) * percent / 100) - 1)
+    return ordered[index]
+
+
+# ワーカープロセスごとの状態（_init_workerで設定する）
+_worker: Dict = {}
+
+
+def _run_keeping_main_module(function, *args):
+    """Streamlitがスクリプトの実行時に差し替える__main__を元に戻す
+
+    __main__がapp.pyのままだと、次のタスクを受け取る際に関数を復元できなくなる。
+    """
+    main_module = sys.modules["__main__"]
+    try:
+        return function(*args)
+    finally:
+        sys.modules["__main__"] = main_module
+
+
+def _init_worker(config: LoadTestConfig, work_dir: str):
+    """ワーカープロセスでフェイクのDBとLLMに差し替え、初回実行を済ませておく
+
+    AppTestは実行のたびにStreamlitのRuntimeをプロセス全体で差し替えるため、1プロセスで同時に1セッションだけを実行する。
+    """
+    process_dir = os.path.join(work_dir, str(os.getpid()))
+    os.makedirs(process_dir)
+    os.environ["STYLES_JOURNAL_PATH"] = os.path.join(process_dir, "journal.json")
+    os.environ["MODEL_ROUTE_STATS_PATH"] = os.path.join(process_dir, "route_stats.jsonl")
+
+    rng = random.Random(config.seed)
+    database = FakeDatabase(config.db_latency, rng)
+    seed_database(database, config)
+    mock.patch("firebase_operations.db", database).start()
+    mock.patch("firebase_operations.initialize_firebase", lambda: None).start()
+    mock.patch("ui_components.ChatOpenAI", create_fake_llm(config, rng)).start()
+
+    # インポートや初回実行のコストを計測から除外する
+    _run_keeping_main_module(run_session, -1, LoadTestConfig(iterations=0, timeout=config.timeout), SessionRecorder())
+    _worker.update(
+        rng=rng,
+        baseline_rss=_max_rss_bytes(),
+        baseline_threads=threading.active_count(),
+        peak_threads=threading.active_count(),
+    )
+
+    def sample_threads():
+        while True:
+            _worker["peak_threads"] = max(_worker["peak_threads"], threading.active_count())
+            time.sleep(0.1)
+
+    threading.Thread(target=sample_threads, daemon=True).start()
+
+
+def _run_user(user_id: int, config: LoadTestConfig) -> Dict:
+    """ワーカープロセスで1ユーザー分のセッションを実行し、計測結果を返す"""
+    if config.seed is not None:
+        _worker["rng"].seed(config.seed + user_id)
+    recorder = SessionRecorder()
+    app_error = harness_error = None
+    try:
+        _run_keeping_main_module(run_session, user_id, config, recorder)
+    except AppError as e:
+        app_error = f"user {user_id}: {e}"
+    except Exception as e:
+        harness_error = f"user {user_id}: {e!r}"
+    return {
+        "pid": os.getpid(),
+        "timings": recorder.timings,
+        "app_error": app_error,
+        "harness_error": harness_error,
+        "routes": get_route_stats().summary(),
+        "baseline_rss": _worker["baseline_rss"],
+        "rss": _max_rss_bytes(),
+        "baseline_threads": _worker["baseline_threads"],
+        "peak_threads": _worker["peak_threads"],
+    }
+
+
+def run_load_test(config: LoadTestConfig) -> Dict:
+    """フェイクのDBとLLMに差し替えたワーカープロセスで、app.pyのセッションを同時実行して計測する"""
+    with tempfile.TemporaryDirectory() as work_dir, \
+            ProcessPoolExecutor(max_workers=config.concurrency, initializer=_init_worker,
+                                initargs=(config, work_dir)) as executor:
+        # 全ワーカーの初期化を済ませてから計測を始める
+        list(executor.map(time.sleep, [0.5] * config.concurrency))
+        start = time.perf_counter()
+        results = list(executor.map(_run_user, range(config.users), [config] * config.users))
+        duration = time.perf_counter() - start
+
+    timings: Dict[str, List[float]] = {}
+    for result in results:
+        for name, values in result["timings"].items():
+            timings.setdefault(name, []).extend(values)
+
+    # ワーカープロセスごとの最後の結果に、そのプロセスの累計が入っている
+    processes: Dict[int, Dict] = {}
+    sessions_per_process: Dict[int, int] = {}
+    for result in results:
+        processes[result["pid"]] = result
+        sessions_per_process[result["pid"]] = sessions_per_process.get(result["pid"], 0) + 1
+
+    routes: Dict[str, Dict] = {}
+    for process in processes.values():
+        for route in process["routes"]:
+            merged = routes.setdefault(route["route"], {"route": route["route"], "count": 0, "total_cost": 0.0})
+            merged["count"] += route["count"]
+            merged["total_cost"] += route["total_cost"]
+
+    memory_available = all(p["rss"] is not None for p in processes.values())
+    operations = {
+        name: {
+            "count": len(values),
+            "mean": statistics.mean(values),
+            "p50": _percentile(values, 50),
+            "p95": _percentile(values, 95),
+            "max": max(values),
+        }
+        for name, values in sorted(timings.items())
+    }
+    app_errors = [result["app_error"] for result in results if result["app_error"]]
+    harness_errors = [result["harness_error"] for result in results if result["harness_error"]]
+    completed = len(results) - len(app_errors) - len(harness_errors)
+    total_operations = sum(len(values) for values in timings.values())
+    return {
+        "config": asdict(config),
+        "duration": duration,
+        "processes": len(processes),
+        "sessions_completed": completed,
+        "app_errors": app_errors,
+        "harness_errors": harness_errors,
+        "throughput": {
+            "operations_per_second": total_operations / duration if duration else 0.0,
+            "sessions_per_second": completed / duration if duration else 0.0,
+        },
+        "operations": operations,
+        "routes": sorted(routes.values(), key=lambda route: route["route"]),
+        "memory": {
+            "peak_rss_bytes": max(p["rss"] for p in processes.values()) if memory_available else None,
+            "per_session_bytes": (
+                sum(p["rss"] - p["baseline_rss"] for p in processes.values()) / len(results)
+                if memory_available else None
+            ),
+        },
+        "threads": {
+            "baseline": max(p["baseline_threads"] for p in processes.values()),
+            "peak": max(p["peak_threads"] for p in processes.values()),
+        },
+    }
+
+
+def format_report(result: Dict) -> str:
+    """計測結果を読みやすい文字列に整形する"""
+    config = result["config"]
+    lines = [
+        f"ユーザー数: {config['users']}  同時実行数: {config['concurrency']}（ワーカープロセス {result['processes']}）  "
+        f"繰り返し: {config['iterations']}",
+        f"所要時間: {result['duration']:.2f}s  完了セッション: {result['sessions_completed']}  "
+        f"アプリのエラー: {len(result['app_errors'])}  ツールのエラー: {len(result['harness_errors'])}",
+        f"スループット: {result['throughput']['operations_per_second']:.2f} ops/s, "
+        f"{result['throughput']['sessions_per_second']:.2f} sessions/s",
+        "",
+        f"{'operation':<14}{'count':>7}{'mean':>9}{'p50':>9}{'p95':>9}{'max':>9}",
+    ]
+    for name, stats in result["operations"].items():
+        lines.append(
+            f"{name:<14}{stats['count']:>7}{stats['mean']:>9.3f}{stats['p50']:>9.3f}"
+            f"{stats['p95']:>9.3f}{stats['max']:>9.3f}"
+        )
+    for route in result["routes"]:
+        lines.append(f"ルート {route['route']}: {route['count']}回  推定費用 ${route['total_cost']:.4f}")
+    memory = result["memory"]
+    if memory["per_session_bytes"] is not None:
+        lines += [
+            "",
+            f"プロセスあたりのピークRSS: {memory['peak_rss_bytes'] / 2**20:.1f} MiB  "
+            f"セッションあたりの増加: {memory['per_session_bytes'] / 2**20:.2f} MiB",
+        ]
+    threads = result["threads"]
+    lines.append(f"プロセスあたりのスレッド数: 開始時 {threads['baseline']}  最大 {threads['peak']}")
+    for error in result["app_errors"]:
+        lines.append(f"アプリのエラー: {error}")
+    for error in result["harness_errors"]:
+        lines.append(f"ツールのエラー: {error}")
+    return "\n".join(lines)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="フェイクのDBとLLMを使ってapp.pyの同時実行性能を計測します。")
+    parser.add_argument("--users", type=int, default=20, help="シミュレートするユーザー数")
+    parser.add_argument("--concurrency", type=int, default=10, help="同時に実行するセッション数（ワーカープロセス数）")
+    parser.add_argument("--iterations", type=int, default=3, help="1ユーザーあたりの文体追加・変換の繰り返し回数")
+    parser.add_argument("--db-latency", type=float, default=0.08, help="DB操作1回あたりの遅延の中央値（秒）")
+    parser.add_argument("--llm-first-token", type=float, default=0.6, help="LLMの最初のトークンまでの遅延の中央値（秒）")
+    parser.add_argument("--llm-chunk-latency", type=float, default=0.02, help="LLMのチャンク間の遅延の中央値（秒）")
+    parser.add_argument("--llm-chunks", type=int, default=40, help="LLMが出力するチャンク数")
+    parser.add_argument("--sigma", type=float, default=0.5, help="遅延の対数正規分布のσ")
+    parser.add_argument("--seed-examples", type=int, default=20, help="変換に使う文体の例文数")
+    parser.add_argument("--timeout", type=float, default=120.0, help="1回のスクリプト実行のタイムアウト（秒）")
+    parser.add_argument("--seed", type=int, default=None, help="乱数シード")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力する")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    config = LoadTestConfig(
+        users=args.users,
+        concurrency=args.concurrency,
+        iterations=args.iterations,
+        db_latency=Latency(args.db_latency, args.sigma),
+        llm_first_token_latency=Latency(args.llm_first_token, args.sigma),
+        llm_chunk_latency=Latency(args.llm_chunk_latency, args.sigma),
+        llm_output_chunks=args.llm_chunks,
+        seed_examples=args.seed_examples,
+        timeout=args.timeout,
+        seed=args.seed,
+    )
+    result = run_load_test(config)
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        print(format_report(result))
+    # アプリのエラーは1、負荷試験ツール自体のエラーだけなら2で終了する
+    if result["app_errors"]:
+        return 1
+    return 2 if result["harness_errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import List
+from typing import Dict, List, Optional
 
 
 @dataclass
@@ -11,3 +11,27 @@ class Example:
 class Style:
     name: str
     examples: List[Example]
+
+@dataclass
+class SyncStatus:
+    pending: bool
+    last_synced_at: Optional[float] = None
+    last_error: Optional[str] = None
+    journal_error: Optional[str] = None
+
+@dataclass
+class Route:
+    name: str
+    model: str
+    temperature: float
+    max_input_chars: Optional[int] = None
+    max_prompt_tokens: Optional[int] = None
+    slo_fallback_max_prompt_tokens: Optional[int] = None
+    input_cost_per_1m: float = 0.0
+    output_cost_per_1m: float = 0.0
+
+@dataclass
+class RoutingConfig:
+    routes: List[Route]
+    style_latency_slos: Dict[str, float]
+    min_samples: int = 5
@@ -0,0 +1,297 @@
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+import streamlit as st
+import tiktoken
+
+from models import Route, RoutingConfig
+
+# 過去のレイテンシとして保持する1ルートあたりの件数
+LATENCY_HISTORY_SIZE = 200
+# 記録ファイルを書き直すまでの行数
+ROUTE_STATS_MAX_FILE_ENTRIES = 5000
+# トークン数の計算に使うエンコーディングの取得に失敗した後、再取得するまでの秒数
+ENCODING_RETRY_INTERVAL = 60.0
+
+logger = logging.getLogger(__name__)
+
+
+def load_routing_config(path: str) -> RoutingConfig:
+    """ルーティングのルールをJSONファイルから読み込む"""
+    with open(path, encoding='utf-8') as f:
+        raw_config = json.load(f)
+    routes = [Route(**route) for route in raw_config.get('routes', [])]
+    if not routes:
+        raise ValueError("ルートが1つも定義されていません。")
+    return RoutingConfig(
+        routes=routes,
+        style_latency_slos=raw_config.get('style_latency_slos', {}),
+        min_samples=raw_config.get('min_samples', 5)
+    )
+
+@st.cache_resource
+def get_routing_config() -> RoutingConfig:
+    """アプリで使うルーティングのルールを取得"""
+    return load_routing_config(os.getenv('MODEL_ROUTES_PATH', 'model_routes.json'))
+
+_encoding_lock = threading.Lock()
+_encoding: Optional[tiktoken.Encoding] = None
+_encoding_retry_at = 0.0
+
+def _get_encoding() -> Optional[tiktoken.Encoding]:
+    """トークン数の計算に使うエンコーディング（取得できなければNone）
+
+    初回の取得時にエンコーディングのデータをダウンロードするため、失敗した場合は
+    ENCODING_RETRY_INTERVAL秒後に再取得する。
+    """
+    global _encoding, _encoding_retry_at
+    with _encoding_lock:
+        if _encoding is None and time.monotonic() >= _encoding_retry_at:
+            try:
+                _encoding = tiktoken.get_encoding('o200k_base')
+            except Exception:
+                _encoding_retry_at = time.monotonic() + ENCODING_RETRY_INTERVAL
+                logger.warning("トークン数の計算に使うエンコーディングを取得できませんでした。文字数で近似します", exc_info=True)
+        return _encoding
+
+def count_tokens(text: str) -> int:
+    """テキストのトークン数を数える"""
+    encoding = _get_encoding()
+    if encoding is None:
+        # エンコーディングを取得できない場合は文字数で近似する
+        return len(text)
+    return len(encoding.encode(text))
+
+def matches_route(route: Route, input_chars: int, prompt_tokens: int) -> bool:
+    """入力の文字数とプロンプトのトークン数がルートの条件を満たすか"""
+    if route.max_input_chars is not None and input_chars > route.max_input_chars:
+        return False
+    if route.max_prompt_tokens is not None and prompt_tokens > route.max_prompt_tokens:
+        return False
+    return True
+
+def select_route(
+    config: RoutingConfig,
+    style_name: str,
+    input_text: str,
+    prompt_tokens: int,
+    stats: Optional["RouteStats"] = None
+) -> Route:
+    """変換に使うルートを選択する
+
+    ルートは定義順に条件を確認し、最初に条件を満たしたものを使う（どれも満たさなければ最後のルート）。
+    文体にレイテンシの目標値がある場合は、その文体での最初の出力までの時間の実績p95が目標値を超えるルートを避け、
+    より前に定義されたルートに切り替える。切り替え先にできるのは、slo_fallback_max_prompt_tokensが設定され、
+    プロンプトのトークン数がその値以下のルートだけ。
+    """
+    index = next(
+        (i for i, route in enumerate(config.routes) if matches_route(route, len(input_text), prompt_tokens)),
+        len(config.routes) - 1
+    )
+    latency_slo = config.style_latency_slos.get(style_name)
+    if latency_slo is None or stats is None:
+        return config.routes[index]
+
+    candidates = [config.routes[index]] + [
+        route for route in reversed(config.routes[:index])
+        if route.slo_fallback_max_prompt_tokens is not None and prompt_tokens <= route.slo_fallback_max_prompt_tokens
+    ]
+    # 全体の所要時間は入力の長さに左右されるため、最初の出力までの時間で比較する
+    p95s = [stats.p95_first_chunk_latency(route.name, config.min_samples, style_name) for route in candidates]
+    for route, p95 in zip(candidates, p95s):
+        # 実績が足りないルートは目標値を満たすものとして扱う
+        if p95 is None or p95 <= latency_slo:
+            return route
+    return min(zip(candidates, p95s), key=lambda candidate: candidate[1])[0]
+
+def estimate_cost(route: Route, prompt_tokens: int, output_tokens: int) -> float:
+    """ルートの単価から費用（USD）を見積もる"""
+    return (prompt_tokens * route.input_cost_per_1m + output_tokens * route.output_cost_per_1m) / 1_000_000
+
+def _p95(values: List[float]) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(len(ordered) * 0.95) - 1)]
+
+def _parse_entry(line: str) -> Dict:
+    """記録ファイルの1行を読み込む（形式が正しくなければ例外を送出）"""
+    entry = json.loads(line)
+    entry['route'] = str(entry['route'])
+    entry['latency'] = float(entry['latency'])
+    entry['cost'] = float(entry['cost'])
+    if entry.get('first_chunk_latency') is not None:
+        entry['first_chunk_latency'] = float(entry['first_chunk_latency'])
+    if entry.get('style') is not None:
+        entry['style'] = str(entry['style'])
+    return entry
+
+class RouteStats:
+    """ルートごとのレイテンシと費用を記録する
+
+    記録はJSON Lines形式でファイルに追記し、起動時に読み込んでルートの選択に使う。
+    ファイルがmax_file_entries行を超えたら、古い内容を「.1」「.2」…の空いている番号を付けたファイルに退避し、
+    ルートごと、およびルートと文体の組ごとに直近LATENCY_HISTORY_SIZE件だけを残したファイルに書き直す。
+    書き直したファイルの先頭には、残さなかった記録のルートごとの件数と費用の累計を記録する。
+    """
+
+    def __init__(self, path: str, max_file_entries: int = ROUTE_STATS_MAX_FILE_ENTRIES):
+        self._path = path
+        self._max_file_entries = max_file_entries
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Deque[Dict]] = {}
+        self._style_entries: Dict[Tuple[str, str], Deque[Dict]] = {}
+        self._counts: Dict[str, int] = {}
+        self._costs: Dict[str, float] = {}
+        self._file_entries = 0
+
+        try:
+            if os.path.exists(path):
+                with open(path, encoding='utf-8') as f:
+                    for line in f:
+                        if not line.strip():
+                            continue
+                        try:
+                            raw = json.loads(line)
+                            if isinstance(raw, dict) and 'totals' in raw:
+                                self._add_totals(raw['totals'])
+                                continue
+                            self._file_entries += 1
+                            self._add(_parse_entry(line))
+                        except (ValueError, KeyError, TypeError, AttributeError):
+                            logger.warning("ルートの記録を読み飛ばしました: %s", line.strip())
+        except OSError:
+            logger.exception("ルートの記録を読み込めませんでした")
+
+    def record(self, route: Route, style_name: str, input_chars: int, prompt_tokens: int,
+               output_tokens: int, first_chunk_latency: Optional[float], latency: float):
+        """1回の変換の結果を記録する（ファイルへの書き込みに失敗しても変換は妨げない）"""
+        entry = {
+            'timestamp': time.time(),
+            'route': route.name,
+            'model': route.model,
+            'style': style_name,
+            'input_chars': input_chars,
+            'prompt_tokens': prompt_tokens,
+            'output_tokens': output_tokens,
+            'first_chunk_latency': first_chunk_latency,
+            'latency': latency,
+            'cost': estimate_cost(route, prompt_tokens, output_tokens),
+        }
+        with self._lock:
+            self._add(entry)
+            try:
+                with open(self._path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+                self._file_entries += 1
+                # 残す記録だけで上限に近い場合に書き直しを繰り返さないよう、残す件数の2倍も下限にする
+                if self._file_entries >= max(self._max_file_entries, 2 * len(self._retained_entries())):
+                    self._compact()
+            except OSError:
+                logger.exception("ルートの記録をファイルに書き込めませんでした")
+
+    def p95_latency(self, route_name: str, min_samples: int = 1) -> Optional[float]:
+        """ルートの全体の所要時間のp95（記録がmin_samples件未満ならNone）"""
+        with self._lock:
+            entries = list(self._entries.get(route_name, []))
+        return self._p95_of(entries, 'latency', min_samples)
+
+    def p95_first_chunk_latency(self, route_name: str, min_samples: int = 1,
+                                style_name: Optional[str] = None) -> Optional[float]:
+        """ルートの最初の出力までの時間のp95（style_nameを指定した場合はその文体の記録だけで計算。
+        記録がmin_samples件未満ならNone）"""
+        with self._lock:
+            if style_name is None:
+                entries = list(self._entries.get(route_name, []))
+            else:
+                entries = list(self._style_entries.get((route_name, style_name), []))
+        return self._p95_of(entries, 'first_chunk_latency', min_samples)
+
+    def summary(self) -> List[Dict]:
+        """ルートごとの件数、レイテンシ、費用の集計"""
+        with self._lock:
+            route_names = sorted(self._counts)
+            counts = dict(self._counts)
+            costs = dict(self._costs)
+            latencies = {name: [entry['latency'] for entry in self._entries.get(name, [])] for name in route_names}
+        return [
+            {
+                'route': name,
+                'count': counts[name],
+                'mean_latency': sum(latencies[name]) / len(latencies[name]) if latencies[name] else None,
+                'p95_latency': self.p95_latency(name),
+                'p95_first_chunk_latency': self.p95_first_chunk_latency(name),
+                'total_cost': costs[name],
+            }
+            for name in route_names
+        ]
+
+    @staticmethod
+    def _p95_of(entries: List[Dict], key: str, min_samples: int) -> Optional[float]:
+        values = [entry[key] for entry in entries if entry.get(key) is not None]
+        if len(values) < min_samples:
+            return None
+        return _p95(values)
+
+    def _add(self, entry: Dict):
+        name = entry['route']
+        self._entries.setdefault(name, deque(maxlen=LATENCY_HISTORY_SIZE)).append(entry)
+        if entry.get('style') is not None:
+            self._style_entries.setdefault((name, entry['style']), deque(maxlen=LATENCY_HISTORY_SIZE)).append(entry)
+        self._counts[name] = self._counts.get(name, 0) + 1
+        self._costs[name] = self._costs.get(name, 0.0) + entry['cost']
+
+    def _add_totals(self, totals: Dict):
+        """書き直す前の記録の累計を加える"""
+        parsed = {str(name): (int(total['count']), float(total['cost'])) for name, total in totals.items()}
+        for name, (count, cost) in parsed.items():
+            self._counts[name] = self._counts.get(name, 0) + count
+            self._costs[name] = self._costs.get(name, 0.0) + cost
+
+    def _compact(self):
+        """古い記録を退避し、ルートの選択に使う直近の記録だけを残す"""
+        retained = sorted(self._retained_entries(), key=lambda entry: entry.get('timestamp', 0.0))
+        # 残さない記録の件数と費用は累計として引き継ぐ
+        totals = {name: {'count': count, 'cost': self._costs[name]} for name, count in self._counts.items()}
+        for entry in retained:
+            totals[entry['route']]['count'] -= 1
+            totals[entry['route']]['cost'] -= entry['cost']
+
+        archive_number = 1
+        while os.path.exists(f"{self._path}.{archive_number}"):
+            archive_number += 1
+        os.replace(self._path, f"{self._path}.{archive_number}")
+        tmp_path = f"{self._path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'totals': totals}, ensure_ascii=False) + '\n')
+            for entry in retained:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        os.replace(tmp_path, self._path)
+        self._file_entries = len(retained)
+
+    def _retained_entries(self) -> List[Dict]:
+        """ルートの選択に使うために保持している記録（重複を除く）"""
+        retained = {}
+        for entries in list(self._entries.values()) + list(self._style_entries.values()):
+            for entry in entries:
+                retained[id(entry)] = entry
+        return list(retained.values())
+
+def _route_stats_path() -> str:
+    return os.getenv('MODEL_ROUTE_STATS_PATH', '.route_stats.jsonl')
+
+@st.cache_resource
+def get_route_stats() -> RouteStats:
+    """プロセス内で共有するRouteStatsを取得"""
+    return RouteStats(_route_stats_path())
+
+if __name__ == "__main__":
+    # 記録済みの統計を表示する
+    for row in RouteStats(_route_stats_path()).summary():
+        print(json.dumps(row, ensure_ascii=False))
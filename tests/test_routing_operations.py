@@ -0,0 +1,219 @@
+import json
+import os
+import sys
+
+import pytest
+
+# 親ディレクトリをPythonパスに追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import routing_operations  # noqa: E402
+from models import Route, RoutingConfig  # noqa: E402
+from routing_operations import (  # noqa: E402
+    RouteStats,
+    count_tokens,
+    load_routing_config,
+    matches_route,
+    select_route,
+)
+
+SMALL = Route(name="small", model="small-model", temperature=0.7, max_input_chars=100, max_prompt_tokens=1000,
+              slo_fallback_max_prompt_tokens=2000, input_cost_per_1m=1.0, output_cost_per_1m=2.0)
+MEDIUM = Route(name="medium", model="medium-model", temperature=0.7, max_input_chars=1000, max_prompt_tokens=5000,
+               slo_fallback_max_prompt_tokens=10000)
+LARGE = Route(name="large", model="large-model", temperature=0.7)
+
+
+def make_config(style_latency_slos=None, min_samples=2, routes=None):
+    return RoutingConfig(
+        routes=routes or [SMALL, MEDIUM, LARGE],
+        style_latency_slos=style_latency_slos or {},
+        min_samples=min_samples
+    )
+
+def record_first_chunk_latencies(stats, route, first_chunk_latencies, style_name="文体"):
+    for first_chunk_latency in first_chunk_latencies:
+        stats.record(route, style_name, input_chars=10, prompt_tokens=100, output_tokens=10,
+                     first_chunk_latency=first_chunk_latency, latency=first_chunk_latency + 10.0)
+
+@pytest.fixture
+def reset_encoding(monkeypatch):
+    """取得済みのエンコーディングを破棄するフィクスチャ"""
+    monkeypatch.setattr(routing_operations, "_encoding", None)
+    monkeypatch.setattr(routing_operations, "_encoding_retry_at", 0.0)
+
+def test_count_tokens_retries_encoding_after_failure(monkeypatch, caplog, reset_encoding):
+    """エンコーディングを取得できない場合は文字数で近似し、時間を置いて再取得するテスト"""
+    class FakeEncoding:
+        def encode(self, text):
+            return text.split()
+
+    def fail(name):
+        raise OSError("network unreachable")
+
+    monkeypatch.setattr(routing_operations.tiktoken, "get_encoding", fail)
+    assert count_tokens("a b c") == 5
+    assert "エンコーディングを取得できませんでした" in caplog.text
+
+    # 失敗は再取得までの間だけ記憶する
+    monkeypatch.setattr(routing_operations.tiktoken, "get_encoding", lambda name: FakeEncoding())
+    assert count_tokens("a b c") == 5
+    monkeypatch.setattr(routing_operations, "_encoding_retry_at", 0.0)
+    assert count_tokens("a b c") == 3
+
+def test_matches_route_checks_input_chars_and_prompt_tokens():
+    """入力の文字数とプロンプトのトークン数の条件のテスト"""
+    assert matches_route(SMALL, 100, 1000)
+    assert not matches_route(SMALL, 101, 1000)
+    assert not matches_route(SMALL, 100, 1001)
+    assert matches_route(LARGE, 100000, 100000)
+
+def test_select_first_matching_route():
+    """最初に条件を満たしたルートが選ばれるテスト"""
+    config = make_config()
+    assert select_route(config, "文体", "あ" * 50, 500).name == "small"
+    assert select_route(config, "文体", "あ" * 50, 2000).name == "medium"
+    assert select_route(config, "文体", "あ" * 5000, 500).name == "large"
+
+def test_fall_back_to_last_route_when_nothing_matches():
+    """どのルートの条件も満たさない場合は最後のルートが選ばれるテスト"""
+    config = make_config(routes=[SMALL, MEDIUM])
+    assert select_route(config, "文体", "あ" * 5000, 500).name == "medium"
+
+def test_switch_to_faster_route_when_slo_is_missed(tmp_path):
+    """実績が目標値を超えるルートを避けるテスト"""
+    config = make_config(style_latency_slos={"文体": 1.0})
+    stats = RouteStats(str(tmp_path / "stats.jsonl"))
+    record_first_chunk_latencies(stats, LARGE, [3.0, 3.0])
+    record_first_chunk_latencies(stats, MEDIUM, [0.5, 0.5])
+
+    assert select_route(config, "文体", "あ" * 5000, 500, stats).name == "medium"
+    # 目標値のない文体は条件どおりに選ばれる
+    assert select_route(config, "他の文体", "あ" * 5000, 500, stats).name == "large"
+
+def test_slo_uses_first_chunk_latency_not_total_latency(tmp_path):
+    """全体の所要時間が長くても、最初の出力までが目標値以内なら切り替えないテスト"""
+    config = make_config(style_latency_slos={"文体": 1.0})
+    stats = RouteStats(str(tmp_path / "stats.jsonl"))
+    record_first_chunk_latencies(stats, LARGE, [0.8, 0.9])
+
+    assert select_route(config, "文体", "あ" * 5000, 500, stats).name == "large"
+
+def test_choose_fastest_route_when_no_route_meets_slo(tmp_path):
+    """どのルートも目標値を満たさない場合は最も速いルートが選ばれるテスト"""
+    config = make_config(style_latency_slos={"文体": 0.1})
+    stats = RouteStats(str(tmp_path / "stats.jsonl"))
+    record_first_chunk_latencies(stats, LARGE, [3.0, 3.0])
+    record_first_chunk_latencies(stats, MEDIUM, [1.0, 1.0])
+    record_first_chunk_latencies(stats, SMALL, [2.0, 2.0])
+
+    assert select_route(config, "文体", "あ" * 5000, 500, stats).name == "medium"
+
+def test_slo_does_not_switch_beyond_fallback_limit(tmp_path):
+    """目標値を超えていても、プロンプトが切り替え先の上限より長ければ切り替えないテスト"""
+    config = make_config(style_latency_slos={"文体": 1.0})
+    stats = RouteStats(str(tmp_path / "stats.jsonl"))
+    record_first_chunk_latencies(stats, LARGE, [3.0, 3.0])
+    record_first_chunk_latencies(stats, MEDIUM, [3.0, 3.0])
+
+    assert select_route(config, "文体", "あ" * 5000, 20000, stats).name == "large"
+    assert select_route(config, "文体", "あ" * 5000, 8000, stats).name == "large"
+    # 上限を設定していないルートには切り替えない
+    no_fallback = make_config(style_latency_slos={"文体": 1.0},
+                              routes=[Route(name="small", model="small-model", temperature=0.7, max_input_chars=100),
+                                      LARGE])
+    assert select_route(no_fallback, "文体", "あ" * 5000, 500, stats).name == "large"
+
+def test_slo_uses_latency_of_the_same_style(tmp_path):
+    """他の文体の実績は目標値の判定に使わないテスト"""
+    config = make_config(style_latency_slos={"文体": 1.0})
+    stats = RouteStats(str(tmp_path / "stats.jsonl"))
+    record_first_chunk_latencies(stats, LARGE, [3.0, 3.0], style_name="長い文体")
+    record_first_chunk_latencies(stats, LARGE, [0.5, 0.5])
+
+    assert select_route(config, "文体", "あ" * 5000, 500, stats).name == "large"
+    assert stats.p95_first_chunk_latency("large", style_name="長い文体") == 3.0
+    assert stats.p95_first_chunk_latency("large") == 3.0
+
+def test_ignore_routes_with_fewer_than_min_samples(tmp_path):
+    """実績がmin_samples件未満のルートは目標値を満たすものとして扱うテスト"""
+    config = make_config(style_latency_slos={"文体": 1.0}, min_samples=3)
+    stats = RouteStats(str(tmp_path / "stats.jsonl"))
+    record_first_chunk_latencies(stats, LARGE, [3.0, 3.0])
+
+    assert select_route(config, "文体", "あ" * 5000, 500, stats).name == "large"
+
+    record_first_chunk_latencies(stats, LARGE, [3.0])
+    assert select_route(config, "文体", "あ" * 5000, 500, stats).name == "medium"
+
+def test_load_routing_config(tmp_path):
+    """ルールをJSONファイルから読み込むテスト"""
+    path = tmp_path / "routes.json"
+    path.write_text(json.dumps({
+        "routes": [{"name": "large", "model": "large-model", "temperature": 0.5}],
+        "style_latency_slos": {"文体": 2.0}
+    }), encoding='utf-8')
+
+    config = load_routing_config(str(path))
+
+    assert config.routes == [Route(name="large", model="large-model", temperature=0.5)]
+    assert config.style_latency_slos == {"文体": 2.0}
+    assert config.min_samples == 5
+
+def test_load_routing_config_without_routes(tmp_path):
+    """ルートが定義されていない場合はエラーになるテスト"""
+    path = tmp_path / "routes.json"
+    path.write_text(json.dumps({"routes": []}), encoding='utf-8')
+
+    with pytest.raises(ValueError):
+        load_routing_config(str(path))
+
+def test_route_stats_survive_restart(tmp_path):
+    """記録がファイルに保存され、起動時に読み込まれるテスト"""
+    path = str(tmp_path / "stats.jsonl")
+    stats = RouteStats(path)
+    stats.record(SMALL, "文体", input_chars=10, prompt_tokens=1000, output_tokens=500,
+                 first_chunk_latency=0.2, latency=1.0)
+
+    summary = RouteStats(path).summary()
+
+    assert len(summary) == 1
+    assert summary[0]["route"] == "small"
+    assert summary[0]["count"] == 1
+    assert summary[0]["p95_first_chunk_latency"] == 0.2
+    assert summary[0]["total_cost"] == pytest.approx((1000 * 1.0 + 500 * 2.0) / 1_000_000)
+
+def test_route_stats_skip_malformed_lines(tmp_path):
+    """形式が正しくない記録は読み飛ばすテスト"""
+    path = tmp_path / "stats.jsonl"
+    path.write_text("{壊れた行\n" + json.dumps({"route": "small", "latency": 1.0, "cost": 0.0}) + "\n",
+                    encoding='utf-8')
+
+    assert RouteStats(str(path)).p95_latency("small") == 1.0
+
+def test_route_stats_compact_file(tmp_path, monkeypatch):
+    """記録ファイルが上限を超えたら古い記録を退避して直近の記録だけに書き直すテスト"""
+    monkeypatch.setattr(routing_operations, "LATENCY_HISTORY_SIZE", 3)
+    path = tmp_path / "stats.jsonl"
+    stats = RouteStats(str(path), max_file_entries=10)
+
+    record_first_chunk_latencies(stats, SMALL, [float(i) for i in range(25)])
+
+    assert len(path.read_text(encoding='utf-8').splitlines()) <= 11
+    # 退避したファイルは上書きせず、番号を増やして残す
+    assert (tmp_path / "stats.jsonl.1").exists()
+    assert (tmp_path / "stats.jsonl.2").exists()
+    assert stats.summary()[0]["count"] == 25
+    # 書き直した後も、起動時に件数と費用の累計と直近の実績を復元できる
+    restarted = RouteStats(str(path))
+    assert restarted.summary()[0]["count"] == 25
+    assert restarted.summary()[0]["total_cost"] == pytest.approx(stats.summary()[0]["total_cost"])
+    assert restarted.p95_first_chunk_latency("small") == 24.0
+
+def test_route_stats_record_ignores_write_error(tmp_path):
+    """記録ファイルに書き込めなくても変換の結果は記録されるテスト"""
+    stats = RouteStats(str(tmp_path / "missing_dir" / "stats.jsonl"))
+
+    record_first_chunk_latencies(stats, SMALL, [0.1])
+
+    assert stats.p95_first_chunk_latency("small") == 0.1
@@ -0,0 +1,218 @@
+import json
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+# 親ディレクトリをPythonパスに追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import firebase_operations  # noqa: E402
+from firebase_operations import StyleWriter  # noqa: E402
+from models import Example, Style  # noqa: E402
+
+
+def wait_until(condition, timeout=5.0):
+    """条件を満たすまで待機する"""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("条件を満たしませんでした")
+        time.sleep(0.01)
+
+@pytest.fixture
+def written(monkeypatch):
+    """write_stylesを差し替え、書き込まれた文体名のリストを記録するフィクスチャ"""
+    calls = []
+    monkeypatch.setattr(firebase_operations, "write_styles", lambda styles: calls.append([s.name for s in styles]))
+    return calls
+
+@pytest.fixture
+def make_writer():
+    """テスト終了時にバックグラウンドの書き込みを停止するStyleWriterを作るフィクスチャ"""
+    writers = []
+
+    def factory(*args, **kwargs):
+        writer = StyleWriter(*args, **kwargs)
+        writers.append(writer)
+        return writer
+
+    yield factory
+    for writer in writers:
+        writer.close()
+
+def make_styles(*names):
+    return [Style(name=name, examples=[]) for name in names]
+
+def test_coalesce_burst_of_edits_into_single_write(tmp_path, written, make_writer):
+    """連続した保存依頼は最新の内容だけを1回で書き込むテスト"""
+    journal_path = tmp_path / "journal.json"
+    writer = make_writer(str(journal_path), debounce=0.2)
+
+    for i in range(1, 6):
+        writer.enqueue(make_styles(*[f"文体{j}" for j in range(i)]))
+
+    wait_until(lambda: not writer.status().pending)
+    assert written == [[f"文体{j}" for j in range(5)]]
+    assert writer.status().last_synced_at is not None
+    assert not journal_path.exists()
+
+def test_enqueue_writes_journal_before_sync(tmp_path, written, make_writer):
+    """保存依頼がジャーナルに記録されるテスト"""
+    journal_path = tmp_path / "journal.json"
+    writer = make_writer(str(journal_path), debounce=1.0)
+
+    writer.enqueue([Style(name="文体", examples=[Example(input="入力", output="出力")])])
+
+    assert writer.status().pending
+    assert json.loads(journal_path.read_text(encoding='utf-8')) == [
+        {"name": "文体", "examples": [{"input": "入力", "output": "出力"}]}
+    ]
+
+def test_keep_pending_when_edited_during_write(tmp_path, monkeypatch, make_writer):
+    """書き込み中に新しい依頼があれば、続けて最新の内容を書き込むテスト"""
+    journal_path = tmp_path / "journal.json"
+    started = threading.Event()
+    releases = [threading.Event(), threading.Event()]
+    calls = []
+
+    def write_styles(styles):
+        calls.append([s.name for s in styles])
+        started.set()
+        releases[len(calls) - 1].wait(5)
+
+    monkeypatch.setattr(firebase_operations, "write_styles", write_styles)
+    writer = make_writer(str(journal_path), debounce=0.01)
+
+    writer.enqueue(make_styles("古い文体"))
+    assert started.wait(5)
+    writer.enqueue(make_styles("新しい文体"))
+    releases[0].set()
+
+    # 1回目の書き込みが終わっても、新しい依頼は保存待ちのまま残る
+    wait_until(lambda: len(calls) == 2)
+    assert writer.status().pending
+    assert [style.name for style in writer.pending_styles()] == ["新しい文体"]
+    assert journal_path.exists()
+    releases[1].set()
+
+    wait_until(lambda: not writer.status().pending)
+    assert calls == [["古い文体"], ["新しい文体"]]
+    assert not journal_path.exists()
+
+def test_retry_failed_write_with_backoff(tmp_path, monkeypatch, make_writer):
+    """書き込みに失敗した場合はジャーナルを残して再試行するテスト"""
+    journal_path = tmp_path / "journal.json"
+    attempts = []
+
+    def write_styles(styles):
+        attempts.append(time.monotonic())
+        if len(attempts) < 3:
+            raise RuntimeError("offline")
+
+    monkeypatch.setattr(firebase_operations, "write_styles", write_styles)
+    writer = make_writer(str(journal_path), debounce=0.01, retry_interval=0.1)
+
+    writer.enqueue(make_styles("文体"))
+
+    wait_until(lambda: len(attempts) >= 1 and writer.status().last_error == "offline")
+    assert writer.status().pending
+    assert journal_path.exists()
+
+    wait_until(lambda: not writer.status().pending)
+    assert len(attempts) == 3
+    # 失敗が続くと再試行までの待ち時間が長くなる
+    assert attempts[2] - attempts[1] > attempts[1] - attempts[0]
+    assert writer.status().last_error is None
+    assert not journal_path.exists()
+
+def test_replay_journal_on_startup(tmp_path, written, make_writer):
+    """前回書き込めなかったジャーナルを起動時に再送するテスト"""
+    journal_path = tmp_path / "journal.json"
+    journal_path.write_text(json.dumps([{"name": "未保存の文体", "examples": []}]), encoding='utf-8')
+
+    writer = make_writer(str(journal_path), debounce=0.01)
+
+    assert [style.name for style in writer.pending_styles()] == ["未保存の文体"]
+    wait_until(lambda: not writer.status().pending)
+    assert written == [["未保存の文体"]]
+    assert not journal_path.exists()
+
+def test_move_corrupt_journal_aside(tmp_path, written, make_writer):
+    """読み込めないジャーナルは退避して空のキューで始めるテスト"""
+    journal_path = tmp_path / "journal.json"
+    journal_path.write_text("{壊れたデータ", encoding='utf-8')
+
+    writer = make_writer(str(journal_path), debounce=0.01)
+
+    assert writer.pending_styles() is None
+    assert not writer.status().pending
+    assert not journal_path.exists()
+    assert (tmp_path / "journal.json.corrupt").read_text(encoding='utf-8') == "{壊れたデータ"
+
+def test_keep_edit_pending_when_journal_write_fails(tmp_path, written, make_writer):
+    """ジャーナルに記録できなくても保存を続けるテスト"""
+    journal_path = tmp_path / "missing_dir" / "journal.json"
+    writer = make_writer(str(journal_path), debounce=0.01)
+
+    writer.enqueue(make_styles("文体"))
+
+    assert writer.status().journal_error is not None
+    wait_until(lambda: not writer.status().pending)
+    assert written == [["文体"]]
+
+def test_keep_syncing_when_journal_cannot_be_removed(tmp_path, written, monkeypatch, make_writer):
+    """ジャーナルを削除できなくても保存を続けるテスト"""
+    def remove(path):
+        raise OSError("permission denied")
+
+    monkeypatch.setattr(firebase_operations.os, "remove", remove)
+    writer = make_writer(str(tmp_path / "journal.json"), debounce=0.01)
+
+    writer.enqueue(make_styles("文体1"))
+    wait_until(lambda: not writer.status().pending)
+    writer.enqueue(make_styles("文体2"))
+    wait_until(lambda: not writer.status().pending)
+
+    assert written == [["文体1"], ["文体2"]]
+    assert writer.status().last_error is None
+
+def test_status_of_each_version(tmp_path, monkeypatch, make_writer):
+    """版数を指定すると、その依頼までの保存状況だけが返るテスト"""
+    release = threading.Event()
+    calls = []
+
+    def write_styles(styles):
+        calls.append([s.name for s in styles])
+        if len(calls) == 2:
+            release.wait(5)
+            raise RuntimeError("offline")
+
+    monkeypatch.setattr(firebase_operations, "write_styles", write_styles)
+    writer = make_writer(str(tmp_path / "journal.json"), debounce=0.01, retry_interval=0.05)
+
+    first_version = writer.enqueue(make_styles("文体1"))
+    wait_until(lambda: not writer.status(first_version).pending)
+    second_version = writer.enqueue(make_styles("文体2"))
+    wait_until(lambda: len(calls) == 2)
+    release.set()
+
+    # 他のセッションの依頼が失敗していても、保存済みの依頼には影響しない
+    wait_until(lambda: writer.status(second_version).last_error == "offline")
+    assert writer.status(second_version).pending
+    assert not writer.status(first_version).pending
+    assert writer.status(first_version).last_error is None
+    wait_until(lambda: not writer.status(second_version).pending)
+
+def test_close_stops_worker_thread(tmp_path, written):
+    """close()でバックグラウンドの書き込みが停止するテスト"""
+    writer = StyleWriter(str(tmp_path / "journal.json"), debounce=10.0)
+    writer.enqueue(make_styles("文体"))
+
+    writer.close()
+
+    assert not writer._thread.is_alive()
+    assert written == []
+    assert (tmp_path / "journal.json").exists()
@@ -1,11 +1,19 @@
+import time
+
 import streamlit as st
 from langchain.prompts import ChatPromptTemplate
 from langchain.schema import StrOutputParser
 from langchain.schema.runnable import RunnablePassthrough
 from langchain_openai import ChatOpenAI
 
-from firebase_operations import save_styles
+from firebase_operations import get_style_writer
 from prompt_operations import create_prompt
+from routing_operations import (
+    count_tokens,
+    get_route_stats,
+    get_routing_config,
+    select_route,
+)
 from style_operations import (
     add_example,
     create_style,
@@ -31,7 +39,7 @@ def render_style_editor(style_to_edit: str, on_example_modified: bool = False):
         else:
             st.session_state.styles.append(create_style(new_style))
             st.session_state.selected_style = new_style
-            save_styles(st.session_state.styles)
+            _save_styles()
             st.session_state.success_message = f"「{new_style}」を追加しました。"
             st.rerun()
 
@@ -60,7 +68,7 @@ def render_style_editor(style_to_edit: str, on_example_modified: bool = False):
                         new_style = remove_example(selected_style, i-1)
                         style_index = next((i for i, style in enumerate(st.session_state.styles) if style.name == style_to_edit))
                         st.session_state.styles[style_index] = new_style
-                        save_styles(st.session_state.styles)
+                        _save_styles()
                         st.session_state.success_message_in_modal = "例文を削除しました。"
                         st.session_state.on_example_modified = True
                         st.rerun()
@@ -87,7 +95,7 @@ def render_style_editor(style_to_edit: str, on_example_modified: bool = False):
                 if style_index is not None:
                     new_style = add_example(selected_style, new_example_input, new_example_output)
                     st.session_state.styles[style_index] = new_style
-                    save_styles(st.session_state.styles)
+                    _save_styles()
                     del st.session_state.new_example_input
                     del st.session_state.new_example_output
                     st.session_state.success_message_in_modal = "例文を追加しました。"
@@ -112,7 +120,7 @@ def render_style_editor(style_to_edit: str, on_example_modified: bool = False):
                     new_style = rename_style(selected_style, new_style_name)
                     st.session_state.styles[style_index] = new_style
                     st.session_state.editing_style = new_style_name
-                    save_styles(st.session_state.styles)
+                    _save_styles()
                     st.session_state.success_message = f"「{style_to_edit}」を「{new_style_name}」に変更しました。"
                     st.rerun()
                 else:
@@ -125,10 +133,40 @@ def render_style_editor(style_to_edit: str, on_example_modified: bool = False):
             style_index = next((i for i, style in enumerate(st.session_state.styles) if style.name == style_to_edit))
             st.session_state.styles.pop(style_index)
             st.session_state.editing_style = None
-            save_styles(st.session_state.styles)
+            _save_styles()
             st.session_state.success_message = f"「{style_to_edit}」を削除しました。"
             st.rerun()
 
+def _save_styles():
+    """文体データの保存を依頼し、このセッションの依頼の版数を記録する"""
+    st.session_state.style_write_version = get_style_writer().enqueue(st.session_state.styles)
+
+def render_sync_status():
+    """このセッションで行った変更の保存状況を表示"""
+    version = st.session_state.get("style_write_version")
+    if version is None:
+        return
+    if get_style_writer().status(version).pending:
+        _render_pending_sync_status(version)
+    else:
+        _render_sync_status_message(version)
+
+@st.fragment(run_every=2)
+def _render_pending_sync_status(version: int):
+    """保存中は定期的に状況を更新する（フラグメント内だけを再実行するため、変換結果などは消えない）"""
+    _render_sync_status_message(version)
+
+def _render_sync_status_message(version: int):
+    status = get_style_writer().status(version)
+    if status.journal_error:
+        st.warning(f"変更をローカルに記録できませんでした。保存は続けています: {status.journal_error}")
+    if status.last_error:
+        st.warning(f"データの保存に失敗しました。再試行しています: {status.last_error}")
+    elif status.pending:
+        st.caption("🔄 変更を保存しています…")
+    else:
+        st.caption("✅ すべての変更を保存しました")
+
 def render_text_converter():
     """テキスト変換UIを描画"""
     input_text = st.text_area("変換したい文章を入力してください", height=200)
@@ -143,15 +181,21 @@ def render_text_converter():
         else:
             selected_style = next((style for style in st.session_state.styles if style.name == st.session_state.selected_style))
 
+            system_message = (create_prompt(selected_style, input_text) +
+                              "\n\n入力された文章を指定された文体に変換してください。変換結果だけを出力してください。")
             prompt = ChatPromptTemplate.from_messages([
-                ("system", create_prompt(selected_style, input_text) + 
-                          "\n\n入力された文章を指定された文体に変換してください。変換結果だけを出力してください。"),
+                ("system", system_message),
                 ("user", "{input}")
             ])
 
+            # 入力の長さとプロンプトの大きさからモデルを選ぶ
+            prompt_tokens = count_tokens(system_message) + count_tokens(input_text)
+            route_stats = get_route_stats()
+            route = select_route(get_routing_config(), selected_style.name, input_text, prompt_tokens, route_stats)
+
             model = ChatOpenAI(
-                model="gpt-4.1",
-                temperature=0.7,
+                model=route.model,
+                temperature=route.temperature,
                 streaming=True
             )
 
@@ -165,6 +209,20 @@ def render_text_converter():
             output_container = st.empty()
             output_text = ""
 
+            start = time.perf_counter()
+            first_chunk_latency = None
             for chunk in chain.stream(input_text):
+                if first_chunk_latency is None:
+                    first_chunk_latency = time.perf_counter() - start
                 output_text += chunk
                 output_container.markdown(output_text)
+
+            route_stats.record(
+                route,
+                selected_style.name,
+                input_chars=len(input_text),
+                prompt_tokens=prompt_tokens,
+                output_tokens=count_tokens(output_text),
+                first_chunk_latency=first_chunk_latency,
+                latency=time.perf_counter() - start
+            )